@@ -2,7 +2,8 @@ import os
 import random
 
 source_dir = 'LJSpeech-1.1/wavs'
-all_files = [f for f in os.listdir(source_dir) if f.endswith('.wav')]
+with os.scandir(source_dir) as entries:
+    all_files = [e.name for e in entries if e.is_file(follow_symlinks=False) and e.name.endswith('.wav')]
 
 # Randomly select 500
 sampled_files = random.sample(all_files, 100)
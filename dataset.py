@@ -36,7 +36,7 @@ from tqdm import tqdm
 from torch.utils.data.distributed import DistributedSampler
 from pathlib import Path
 from scipy.io.wavfile import read
-from preprocess import MAX_WAV_VALUE, get_mel, normalize
+from preprocess import MAX_WAV_VALUE, SILENCE_LOG_MEL, get_mel, normalize
 
 device = torch.device("cuda")
 
@@ -276,6 +276,48 @@ class Collator:
             "filename": filename,
         }
 
+    def collate_padded(self, minibatch):
+        """Collate full utterances of different lengths for inference
+            * spectrograms are padded with the log-mel of silence and
+            * target stds with std_min up to the longest utterance
+
+        Args:
+            minibatch (list): records returned by NumpyDataset
+
+        Returns:
+            dict: padded batch, with "lengths" holding the number of mel frames of every utterance
+        """
+        samples_per_frame = self.params.hop_samples
+        lengths = [record["spectrogram"].shape[0] for record in minibatch]
+        n_frames = max(lengths)
+        n_mels = minibatch[0]["spectrogram"].shape[1]
+
+        audio = torch.zeros(len(minibatch), n_frames * samples_per_frame)
+        spectrogram = torch.full((len(minibatch), n_mels, n_frames), SILENCE_LOG_MEL)
+        target_std = torch.full(
+            (len(minibatch), n_frames * samples_per_frame // 2), self.std_min
+        )
+        target_std_hb = torch.full_like(target_std, self.std_min)
+        for i, record in enumerate(minibatch):
+            length = lengths[i]
+            audio[i, : length * samples_per_frame] = record["audio"]
+            spectrogram[i, :, :length] = record["spectrogram"].T
+            target_std[i, : length * samples_per_frame // 2] = torch.repeat_interleave(
+                record["target_std"], samples_per_frame // 2
+            )
+            target_std_hb[
+                i, : length * samples_per_frame // 2
+            ] = torch.repeat_interleave(record["target_std_hb"], samples_per_frame // 2)
+        filename = [record["filename"] for record in minibatch]
+        return {
+            "audio": audio,
+            "spectrogram": spectrogram,
+            "target_std": target_std,
+            "target_std_hb": target_std_hb,
+            "lengths": lengths,
+            "filename": filename,
+        }
+
 
 def from_path(data_root, filelist, params, is_distributed=False):
     dataset = NumpyDataset(data_root, filelist, params, is_training=True)
@@ -291,15 +333,43 @@ def from_path(data_root, filelist, params, is_distributed=False):
     )
 
 
-def from_path_valid(data_root, filelist, params, is_distributed=False):
+def from_path_valid(
+    data_root,
+    filelist,
+    params,
+    is_distributed=False,
+    batch_size=1,
+    num_workers=1,
+    pin_memory=False,
+    prefetch_factor=2,
+):
     dataset = NumpyDataset(data_root, filelist, params, is_training=False)
+    # optionally prefetch more batches per worker so that feature extraction overlaps with the consumer
+    worker_kwargs = dict(prefetch_factor=prefetch_factor) if num_workers > 0 else {}
+    if batch_size > 1:
+        if is_distributed:
+            raise ValueError("batch_size > 1 is not supported with is_distributed.")
+        # group utterances of similar length (file size) so that batches need little padding
+        order = sorted(
+            range(len(dataset)), key=lambda i: os.path.getsize(dataset.filenames[i])
+        )
+        batches = [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+        return torch.utils.data.DataLoader(
+            dataset,
+            batch_sampler=batches,
+            collate_fn=Collator(params, is_training=False).collate_padded,
+            num_workers=num_workers,
+            pin_memory=pin_memory,
+            **worker_kwargs,
+        )
     return torch.utils.data.DataLoader(
         dataset,
         batch_size=1,
         collate_fn=Collator(params, is_training=False).collate,
         shuffle=False,
-        num_workers=1,
+        num_workers=num_workers,
         sampler=DistributedSampler(dataset) if is_distributed else None,
-        pin_memory=False,
+        pin_memory=pin_memory,
         drop_last=False,
+        **worker_kwargs,
     )
@@ -28,20 +28,27 @@
 # limitations under the License.
 # ==============================================================================
 
+import math
 import numpy as np
 import os, sys
+import traceback
 import torch
 import torchaudio
 from tqdm import tqdm
 from pathlib import Path
 
 from dataset import from_path_valid as dataset_from_path_valid
+from preprocess import SILENCE_LOG_MEL
 from argparse import ArgumentParser
 
 from model import FreGrad
+from params import AttrDict
 from learner import _nested_map
 from pytorch_wavelets import DWT1DInverse
 from time import time
+from functools import lru_cache
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, wait
 import librosa
 import librosa.display
 import matplotlib as mpl
@@ -51,10 +58,14 @@ mpl.rcParams.update(mpl.rcParamsDefault)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 def draw_fullband_spec(audio: torch.Tensor, axs):
-    audio = audio.squeeze().cpu().numpy()
-    D = librosa.stft(audio)  # STFT of y
-    S_db = librosa.amplitude_to_db(np.abs(D), ref=np.max)
-    librosa.display.specshow(S_db, x_axis="s", y_axis="linear", ax=axs)
+    # * same STFT as librosa.stft defaults, computed on the device of audio
+    stft = torchaudio.transforms.Spectrogram(n_fft=2048, hop_length=512, power=1.0)
+    D = stft.to(audio.device)(audio.squeeze())  # magnitude STFT of y
+    S_db = torchaudio.functional.amplitude_to_DB(
+        D, multiplier=20.0, amin=1e-5, db_multiplier=0.0, top_db=80.0
+    )
+    S_db = S_db - S_db.max()  # ref=np.max
+    librosa.display.specshow(S_db.cpu().numpy(), x_axis="s", y_axis="linear", ax=axs)
 
 
 def load_state_dict(model, state_dict):
@@ -86,6 +97,34 @@ def restore_from_checkpoint(model, model_dir, step, filename="weights"):
         return model, step
 
 
+@lru_cache(maxsize=None)
+def _cutoff_alias_filter(sr, device, dtype):
+    """Coefficients of highpass_biquad(5 Hz) followed by lowpass_biquad(5500 Hz)
+        * merged into a single 4th-order filter, using the biquad design of torchaudio
+
+    Args:
+        sr (int): sample rate of the filtered signal
+        device (torch.device): device of the filtered signal
+        dtype (torch.dtype): dtype of the filtered signal
+
+    Returns:
+        (torch.Tensor, torch.Tensor): a_coeffs and b_coeffs, both of shape [5]
+    """
+    Q = 0.707
+    a_coeffs, b_coeffs = np.ones(1), np.ones(1)
+    # * sign is -1 for the highpass section and +1 for the lowpass section
+    for cutoff_freq, sign in ((5, -1.0), (5500, 1.0)):
+        w0 = 2 * math.pi * cutoff_freq / sr
+        alpha = math.sin(w0) / 2 / Q
+        b = (1 - sign * math.cos(w0)) / 2
+        a_coeffs = np.convolve(a_coeffs, [1 + alpha, -2 * math.cos(w0), 1 - alpha])
+        b_coeffs = np.convolve(b_coeffs, [b, sign * 2 * b, b])
+    return (
+        torch.tensor(a_coeffs, device=device, dtype=dtype),
+        torch.tensor(b_coeffs, device=device, dtype=dtype),
+    )
+
+
 def remove_cutoff_alias(lowpass, highpass, sr=22050):
     """* This function cut a small part of input and output signal
         * that located around cutoff frequencies
@@ -99,20 +138,347 @@ def remove_cutoff_alias(lowpass, highpass, sr=22050):
     Returns:
         (torch.Tensor, torch.Tensor): filtered signals
     """
-    #
-    lowpass = torchaudio.functional.highpass_biquad(
-        lowpass, sample_rate=sr // 2, cutoff_freq=5
+    # * both bands go through the same highpass + lowpass pair, fused into one pass
+    a_coeffs, b_coeffs = _cutoff_alias_filter(sr // 2, lowpass.device, lowpass.dtype)
+    filtered = torchaudio.functional.lfilter(
+        torch.cat((lowpass, highpass), dim=1), a_coeffs, b_coeffs
     )
-    highpass = torchaudio.functional.highpass_biquad(
-        highpass, sample_rate=sr // 2, cutoff_freq=5
-    )
-    lowpass = torchaudio.functional.lowpass_biquad(
-        lowpass, sample_rate=sr // 2, cutoff_freq=5500
+    return filtered[:, : lowpass.shape[1]], filtered[:, lowpass.shape[1] :]
+
+
+def postprocess(audio, idwt, enable_remove_cutoff_alias=True):
+    """Convert the sampled wavelet-domain audio back to a waveform
+
+    Args:
+        audio (torch.Tensor): [B, 2, L] low and high frequency wavelet coefficients
+        idwt (DWT1DInverse): inverse DWT module
+        enable_remove_cutoff_alias (bool, optional): whether to apply remove_cutoff_alias. Defaults to True.
+
+    Returns:
+        torch.Tensor: [B, 2 * L] waveform
+    """
+    # * OPTIONAL: here, we remove the cutoff alias, a phenomenon cause by redundant information
+    # * around cutoff frequency band
+    if enable_remove_cutoff_alias:
+        l, h = remove_cutoff_alias(audio[:, 0:1, :], audio[:, 1:2, :])
+    else:
+        l, h = audio[:, 0:1, :], audio[:, 1:2, :]
+    # * Convert output in wavelet domain back to origin waveform's domain
+    # * Equation 7 in our paper
+    return idwt((l, [h])).squeeze(1)
+
+
+def match_training_steps(talpha_cum, alpha_cum):
+    """Match every inference step to a continuous training step
+        * by interpolating sqrt(alpha_cum) between neighbouring training steps
+
+    Args:
+        talpha_cum (np.ndarray): cumulative alpha of the training noise schedule
+        alpha_cum (np.ndarray): cumulative alpha of the inference noise schedule
+
+    Raises:
+        ValueError: if an inference step lies outside of the training schedule
+
+    Returns:
+        np.ndarray: float32 continuous training step of every inference step
+    """
+    if np.any(alpha_cum > talpha_cum[0]) or np.any(alpha_cum < talpha_cum[-1]):
+        raise ValueError(
+            "inference noise schedule is not covered by the training noise schedule"
+        )
+    # * talpha_cum is strictly decreasing, so search on its negation
+    t_idx = np.searchsorted(-talpha_cum, -alpha_cum, side="left") - 1
+    t_idx = t_idx.clip(0, len(talpha_cum) - 2)
+    twiddle = (talpha_cum[t_idx] ** 0.5 - alpha_cum**0.5) / (
+        talpha_cum[t_idx] ** 0.5 - talpha_cum[t_idx + 1] ** 0.5
     )
-    highpass = torchaudio.functional.lowpass_biquad(
-        highpass, sample_rate=sr // 2, cutoff_freq=5500
+    return (t_idx + twiddle).astype(np.float32)
+
+
+def sampling_coefficients(T, alpha, alpha_cum, beta, device=device):
+    """Stage the per-step constants of the reverse diffusion on device
+        * so that the sampling loop only indexes them and never builds
+        * tensors from host scalars
+
+    Args:
+        T (np.ndarray): continuous training step matched to each inference step
+        alpha (np.ndarray): 1 - beta
+        alpha_cum (np.ndarray): cumulative product of alpha
+        beta (np.ndarray): inference noise schedule
+        device (torch.device, optional): target device. Defaults to the inference device.
+
+    Returns:
+        dict: "t", "c1", "c2" and "sigma" tensors of shape [len(alpha)]
+    """
+    sigma = np.zeros_like(alpha_cum)
+    sigma[1:] = np.sqrt((1.0 - alpha_cum[:-1]) / (1.0 - alpha_cum[1:]) * beta[1:])
+    coeffs = {
+        "t": np.asarray(T),
+        "c1": 1 / np.sqrt(alpha),
+        "c2": beta / np.sqrt(1 - alpha_cum),
+        "sigma": sigma,
+    }
+    return {
+        k: torch.from_numpy(v.astype(np.float32)).to(device) for k, v in coeffs.items()
+    }
+
+
+@torch.jit.script
+def denoise_step(
+    audio: torch.Tensor,
+    model_out: torch.Tensor,
+    c1: torch.Tensor,
+    c2: torch.Tensor,
+    sigma: torch.Tensor,
+    noise: Optional[torch.Tensor],
+    target_std: torch.Tensor,
+) -> torch.Tensor:
+    """One reverse diffusion update, scripted so the pointwise ops fuse into a single kernel
+
+    Args:
+        audio (torch.Tensor): [B, C, L] current noisy audio in wavelet domain
+        model_out (torch.Tensor): [B, C, L] predicted noise
+        c1 (torch.Tensor): 1 / sqrt(alpha_n)
+        c2 (torch.Tensor): beta_n / sqrt(1 - alpha_cum_n)
+        sigma (torch.Tensor): std of the added noise
+        noise (torch.Tensor, optional): standard normal noise, None at the last step
+        target_std (torch.Tensor): prior std that scales the noise
+
+    Returns:
+        torch.Tensor: [B, C, L] denoised audio clamped to [-1, 1]
+    """
+    x = c1 * (audio - c2 * model_out)
+    if noise is not None:
+        x = x + sigma * noise * target_std
+    return torch.clamp(x, -1.0, 1.0)
+
+
+def model_forward(
+    model, audio, spectrogram, diffusion_step, global_cond=None, autocast_dtype=None
+):
+    """Predict the noise, optionally running the model under autocast
+        * the output is cast back to float32 so that the denoising update stays in full precision
+
+    Args:
+        model (FreGrad): model in eval mode
+        audio (torch.Tensor): [B, C, L] current noisy audio in wavelet domain
+        spectrogram (torch.Tensor): [B, n_mels, frames] conditioning mel-spectrogram
+        diffusion_step (torch.Tensor): [1] continuous diffusion step
+        global_cond (torch.Tensor, optional): global condition. Defaults to None.
+        autocast_dtype (torch.dtype, optional): autocast dtype, None runs in float32. Defaults to None.
+
+    Returns:
+        torch.Tensor: [B, C, L] predicted noise
+    """
+    if autocast_dtype is None:
+        return model(audio, spectrogram, diffusion_step, global_cond)
+    with torch.autocast(audio.device.type, dtype=autocast_dtype):
+        model_out = model(audio, spectrogram, diffusion_step, global_cond)
+    return model_out.float()
+
+
+def get_sampling_graph(
+    graphs,
+    model,
+    spectrogram,
+    target_std,
+    global_cond=None,
+    autocast_dtype=None,
+    postprocess_fn=None,
+    pool=None,
+):
+    """Look up the captured sampling graph for this input shape, capturing it on first use
+
+    Args:
+        graphs (dict): cache of captured graphs, one per spectrogram shape (i.e. frame bucket)
+        model (FreGrad): model in eval mode on a CUDA device
+        spectrogram (torch.Tensor): [B, n_mels, frames] conditioning mel-spectrogram
+        target_std (torch.Tensor): prior std of the wavelet-domain audio
+        global_cond (torch.Tensor, optional): global condition. Defaults to None.
+        autocast_dtype (torch.dtype, optional): autocast dtype of the model. Defaults to None.
+        postprocess_fn (callable, optional): wavelet-to-waveform conversion to capture as well. Defaults to None.
+        pool (tuple, optional): memory pool shared by all captured graphs. Defaults to None.
+
+    Returns:
+        (torch.cuda.CUDAGraph, torch.cuda.CUDAGraph, dict): step graph, postprocess graph and static buffers
+    """
+    key = tuple(spectrogram.shape)
+    if key not in graphs:
+        graphs[key] = build_sampling_graph(
+            model,
+            spectrogram,
+            target_std,
+            global_cond,
+            autocast_dtype,
+            postprocess_fn,
+            pool,
+        )
+    return graphs[key]
+
+
+def build_sampling_graph(
+    model,
+    spectrogram,
+    target_std,
+    global_cond=None,
+    autocast_dtype=None,
+    postprocess_fn=None,
+    pool=None,
+    warmup_iters=3,
+):
+    """Capture one reverse diffusion step into a CUDA graph
+        * The captured step reads every input from static buffers and writes
+        * the denoised audio back in place, so the sampling loop only refreshes
+        * the per-step scalars and replays the graph
+        * If given, postprocess_fn is captured into a second graph that turns
+        * the final static audio into the static waveform output
+
+    Args:
+        model (FreGrad): model in eval mode on a CUDA device
+        spectrogram (torch.Tensor): [B, n_mels, frames] used to size the static buffers
+        target_std (torch.Tensor): prior std used to size the static buffers
+        global_cond (torch.Tensor, optional): global condition. Defaults to None.
+        autocast_dtype (torch.dtype, optional): autocast dtype of the model. Defaults to None.
+        postprocess_fn (callable, optional): wavelet-to-waveform conversion to capture as well. Defaults to None.
+        pool (tuple, optional): memory pool shared by all captured graphs,
+            see torch.cuda.graph_pool_handle(). Defaults to None.
+        warmup_iters (int, optional): eager steps run on a side stream before capture. Defaults to 3.
+
+    Returns:
+        (torch.cuda.CUDAGraph, torch.cuda.CUDAGraph, dict): step graph, postprocess graph
+            (None without postprocess_fn) and static buffers
+    """
+    device = spectrogram.device
+    static = {
+        "audio": torch.zeros(
+            spectrogram.shape[0],
+            model.params.audio_channels,
+            model.params.hop_samples
+            * spectrogram.shape[-1]
+            // model.params.audio_channels,
+            device=device,
+        ),
+        "spectrogram": spectrogram.clone(),
+        "target_std": target_std.clone(),
+        "global_cond": None if global_cond is None else global_cond.clone(),
+        "t": torch.zeros(1, device=device),
+        "c1": torch.zeros((), device=device),
+        "c2": torch.zeros((), device=device),
+        "sigma": torch.zeros((), device=device),
+    }
+    static["noise"] = torch.zeros_like(static["audio"])
+
+    def step():
+        model_out = model_forward(
+            model,
+            static["audio"],
+            static["spectrogram"],
+            static["t"],
+            static["global_cond"],
+            autocast_dtype,
+        )
+        audio = denoise_step(
+            static["audio"],
+            model_out,
+            static["c1"],
+            static["c2"],
+            static["sigma"],
+            # * the default CUDA generator advances its offset on every replay
+            static["noise"].normal_(),
+            static["target_std"],
+        )
+        static["audio"].copy_(audio)
+
+    # * warm up on a side stream so that lazy initialization is not captured
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        for _ in range(warmup_iters):
+            step()
+            if postprocess_fn is not None:
+                postprocess_fn(static["audio"])
+    torch.cuda.current_stream().wait_stream(stream)
+
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph, pool=pool):
+        step()
+
+    post_graph = None
+    if postprocess_fn is not None:
+        post_graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(post_graph, pool=graph.pool()):
+            static["output"] = postprocess_fn(static["audio"])
+    return graph, post_graph, static
+
+
+def pad_to_bucket(spectrogram, target_std, bucket_frames, std_min):
+    """Pad the frame count up to a multiple of bucket_frames
+        * so that utterances of similar length share the same input shape
+
+    Args:
+        spectrogram (torch.Tensor): [B, n_mels, frames] conditioning mel-spectrogram
+        target_std (torch.Tensor): [B, C, L] prior std of the wavelet-domain audio
+        bucket_frames (int): bucket size in mel frames
+        std_min (float): prior std used for the padded part
+
+    Returns:
+        (torch.Tensor, torch.Tensor): padded spectrogram and target_std
+    """
+    n_frames = spectrogram.shape[-1]
+    pad = -n_frames % bucket_frames
+    if pad == 0:
+        return spectrogram, target_std
+    samples_per_frame = target_std.shape[-1] // n_frames
+    spectrogram = torch.nn.functional.pad(spectrogram, (0, pad), value=SILENCE_LOG_MEL)
+    target_std = torch.nn.functional.pad(
+        target_std, (0, pad * samples_per_frame), value=std_min
     )
-    return lowpass, highpass
+    return spectrogram, target_std
+
+
+def reuse_buffer(buffers, name, shape, dtype=torch.float32, device=device, pin_memory=False):
+    """Return a buffer of the given shape backed by a cached allocation
+        * one flat allocation per name, grown to the largest shape seen,
+        * so that memory stays bounded however many distinct shapes go through it
+
+    Args:
+        buffers (dict): cache of flat allocations, keyed by name
+        name (str): name of the buffer
+        shape (tuple): shape of the returned buffer
+        dtype (torch.dtype): dtype of the allocation
+        device (torch.device): device of the allocation
+        pin_memory (bool): allocate in page-locked host memory
+
+    Returns:
+        torch.Tensor: contiguous view of the first elements of the allocation
+    """
+    numel = int(np.prod(shape))
+    buffer = buffers.get(name)
+    if buffer is None or buffer.numel() < numel:
+        buffer = torch.empty(numel, dtype=dtype, device=device, pin_memory=pin_memory)
+        buffers[name] = buffer
+    return buffer[:numel].view(shape)
+
+
+def warmup(
+    model, spectrogram, target_std, global_cond=None, autocast_dtype=None, iters=3
+):
+    """Run a few model forwards on this input shape
+        * so that torch.compile and its graph recording happen outside of the timed region
+
+    Args:
+        model (FreGrad): model in eval mode
+        spectrogram (torch.Tensor): [B, n_mels, frames] conditioning mel-spectrogram
+        target_std (torch.Tensor): prior std of the wavelet-domain audio
+        global_cond (torch.Tensor, optional): global condition. Defaults to None.
+        autocast_dtype (torch.dtype, optional): autocast dtype of the model. Defaults to None.
+        iters (int, optional): number of forwards. Defaults to 3.
+    """
+    with torch.inference_mode():
+        audio = torch.randn_like(target_std)
+        t = torch.zeros(1, device=spectrogram.device)
+        for _ in range(iters):
+            model_forward(model, audio, spectrogram, t, global_cond, autocast_dtype)
 
 
 def predict(
@@ -125,51 +491,113 @@ def predict(
     alpha=None,
     alpha_cum=None,
     beta=None,
+    coeffs=None,
+    graphs=None,
+    buffers=None,
+    autocast_dtype=None,
+    postprocess_fn=None,
+    generator=None,
+    graph_pool=None,
 ):
-    with torch.no_grad():
+    with torch.inference_mode():
         # Expand rank 2 tensors by adding a batch dimension.
         if len(spectrogram.shape) == 2:
             spectrogram = spectrogram.unsqueeze(0)
         spectrogram = spectrogram.to(device)
 
-        audio = (
-            torch.randn(
-                spectrogram.shape[0],
-                model.params.audio_channels,
-                model.params.hop_samples
-                * spectrogram.shape[-1]
-                // model.params.audio_channels,
-                device=device,
-            )
-            * target_std
+        shape = (
+            spectrogram.shape[0],
+            model.params.audio_channels,
+            model.params.hop_samples
+            * spectrogram.shape[-1]
+            // model.params.audio_channels,
         )
 
-        for n in range(len(alpha) - 1, -1, -1):
-            c1 = 1 / alpha[n] ** 0.5
-            c2 = beta[n] / (1 - alpha_cum[n]) ** 0.5
-            audio = c1 * (
-                audio
-                - c2
-                * model(
-                    audio,
-                    spectrogram,
-                    torch.tensor([T[n]], device=audio.device),
-                    global_cond,
-                ).squeeze(1)
+        if coeffs is None:
+            coeffs = sampling_coefficients(
+                T, alpha, alpha_cum, beta, spectrogram.device
+            )
+        n_steps = len(coeffs["t"])
+
+        if graphs is not None:
+            # * replay the captured step instead of dispatching the model op by op
+            graph, post_graph, static = get_sampling_graph(
+                graphs,
+                model,
+                spectrogram,
+                target_std,
+                global_cond,
+                autocast_dtype,
+                postprocess_fn,
+                graph_pool,
+            )
+            static["spectrogram"].copy_(spectrogram)
+            static["target_std"].copy_(target_std)
+            if global_cond is not None:
+                static["global_cond"].copy_(global_cond)
+            static["audio"].normal_(generator=generator).mul_(static["target_std"])
+            for n in range(n_steps - 1, -1, -1):
+                static["t"].copy_(coeffs["t"][n : n + 1])
+                static["c1"].copy_(coeffs["c1"][n])
+                static["c2"].copy_(coeffs["c2"][n])
+                static["sigma"].copy_(coeffs["sigma"][n])
+                graph.replay()
+            if post_graph is not None:
+                post_graph.replay()
+                return static["output"].clone()
+            return static["audio"].clone()
+
+        if buffers is not None:
+            # * reuse the starting audio and noise buffers across calls
+            audio = reuse_buffer(buffers, "audio", shape).normal_(generator=generator)
+            audio = audio.mul_(target_std)
+            noise = reuse_buffer(buffers, "noise", shape)
+        else:
+            audio = torch.randn(shape, generator=generator, device=device) * target_std
+            noise = None
+
+        for n in range(n_steps - 1, -1, -1):
+            model_out = model_forward(
+                model,
+                audio,
+                spectrogram,
+                coeffs["t"][n : n + 1],
+                global_cond,
+                autocast_dtype,
+            )
+            if n == 0:
+                step_noise = None
+            elif noise is not None:
+                step_noise = noise.normal_(generator=generator)
+            else:
+                step_noise = torch.randn(
+                    audio.shape, generator=generator, device=audio.device
+                )
+            audio = denoise_step(
+                audio,
+                model_out,
+                coeffs["c1"][n],
+                coeffs["c2"][n],
+                coeffs["sigma"][n],
+                step_noise,
+                target_std,
             )
 
-            if n > 0:
-                noise = torch.randn_like(audio) * target_std
-                sigma = (
-                    (1.0 - alpha_cum[n - 1]) / (1.0 - alpha_cum[n]) * beta[n]
-                ) ** 0.5
-                audio += sigma * noise
-            audio = torch.clamp(audio, -1.0, 1.0)
-
+        if postprocess_fn is not None:
+            audio = postprocess_fn(audio)
         return audio
 
 
-def main(args):
+def setup(args):
+    """Load the model and build everything that is shared by all filelists
+        * so that a long-lived process pays for it only once
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+
+    Returns:
+        AttrDict: inference state consumed by run()
+    """
     # * load saved params_saved.py in model_dir
     sys.path.append(os.path.join(args.model_dir))
     # * load the saved parameters of the model from "params_saved.py"
@@ -228,12 +656,18 @@ def main(args):
         else:
             T_OVERRIDE = len(params.inference_noise_schedule)
 
-    dataset_test = dataset_from_path_valid(args.data_root, args.filelist, params)
     model = FreGrad(params)
 
     model, step = restore_from_checkpoint(model, args.model_dir, args.step)
     model = model.to(device)
     model.eval()
+    if args.compile:
+        model = torch.compile(model, mode="reduce-overhead")
+    autocast_dtype = {
+        "fp32": None,
+        "bf16": torch.bfloat16,
+        "fp16": torch.float16,
+    }[args.precision]
 
     dir_parent = Path(args.model_dir).parent
     dir_base = os.path.basename(args.model_dir)
@@ -252,9 +686,17 @@ def main(args):
     os.makedirs(sample_path, exist_ok=True)
 
     idwt = DWT1DInverse().to(device)
+    enable_remove_cutoff_alias = (
+        hasattr(params, "enable_remove_cutoff_alias")
+        and params.enable_remove_cutoff_alias
+    )
 
-    gen_dur = []
-    n_samples = []
+    def postprocess_fn(audio):
+        return postprocess(audio, idwt, enable_remove_cutoff_alias)
+
+    if args.compile:
+        # * fuse the filtering and the IDWT of every output
+        postprocess_fn = torch.compile(postprocess_fn)
 
     fast_sampling = False
     training_noise_schedule = np.array(model.params.noise_schedule)
@@ -271,92 +713,213 @@ def main(args):
     alpha = 1 - beta
     alpha_cum = np.cumprod(alpha)
 
-    T = []
-    for s in range(len(inference_noise_schedule)):
-        for t in range(len(training_noise_schedule) - 1):
-            if talpha_cum[t + 1] <= alpha_cum[s] <= talpha_cum[t]:
-                twiddle = (talpha_cum[t] ** 0.5 - alpha_cum[s] ** 0.5) / (
-                    talpha_cum[t] ** 0.5 - talpha_cum[t + 1] ** 0.5
-                )
-                T.append(t + twiddle)
-                break
-    T = np.array(T, dtype=np.float32)
+    T = match_training_steps(talpha_cum, alpha_cum)
+    # * staged on device once and shared by every utterance
+    coeffs = sampling_coefficients(T, alpha, alpha_cum, beta)
+
+    # * captured sampling graphs, keyed by spectrogram shape
+    graphs = {} if args.cuda_graph and device.type == "cuda" else None
+    # * one memory pool shared by the graphs of every shape
+    graph_pool = torch.cuda.graph_pool_handle() if graphs is not None else None
+    # * draws the eager noise and the starting noise,
+    # * captured steps use the default CUDA generator
+    generator = torch.Generator(device=device)
+    if args.seed is not None:
+        generator.manual_seed(args.seed)
+        if graphs is not None:
+            # * the noise inside captured graphs comes from the default CUDA generator
+            torch.cuda.manual_seed(args.seed)
+    else:
+        generator.seed()
+    # * sampling buffers reused across utterances, sized for the longest batch so far
+    buffers = {}
+    # * input shapes the compiled model has already been warmed up on
+    compiled_shapes = set()
+
+    return AttrDict(
+        args=args,
+        params=params,
+        model=model,
+        autocast_dtype=autocast_dtype,
+        sample_path=sample_path,
+        postprocess_fn=postprocess_fn,
+        T=T,
+        alpha=alpha,
+        alpha_cum=alpha_cum,
+        beta=beta,
+        coeffs=coeffs,
+        graphs=graphs,
+        graph_pool=graph_pool,
+        generator=generator,
+        buffers=buffers,
+        compiled_shapes=compiled_shapes,
+        host_buffers={},
+        writer=ThreadPoolExecutor(max_workers=2),
+    )
 
-    for i, features in tqdm(enumerate(dataset_test)):
-        features = _nested_map(
-            features, lambda x: x.to(device) if isinstance(x, torch.Tensor) else x
-        )
-        with torch.no_grad():
-            spectrogram = features["spectrogram"]
-            target_std_lb = features["target_std"]
-            target_std_hb = features["target_std_hb"]
 
-            target_std = torch.cat(
-                (target_std_lb[:, None, :], target_std_hb[:, None, :]), dim=1
+def run(state, filelist):
+    """Generate every utterance of a filelist with the state built by setup()
+
+    Args:
+        state (AttrDict): inference state returned by setup()
+        filelist (str): text file containing data path
+    """
+    args, params, model = state.args, state.params, state.model
+    dataset_test = dataset_from_path_valid(
+        args.data_root,
+        filelist,
+        params,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        pin_memory=device.type == "cuda",
+        prefetch_factor=4,
+    )
+
+    gen_dur = []
+    n_samples = []
+    writes = []
+
+    try:
+        for i, features in tqdm(enumerate(dataset_test)):
+            features = _nested_map(
+                features,
+                lambda x: x.to(device, non_blocking=True)
+                if isinstance(x, torch.Tensor)
+                else x,
             )
+            with torch.inference_mode():
+                spectrogram = features["spectrogram"]
+                target_std_lb = features["target_std"]
+                target_std_hb = features["target_std_hb"]
 
-            if params.condition_prior:
-                target_std_specdim = target_std[:, :: params.hop_samples].unsqueeze(1)
-                spectrogram = torch.cat([spectrogram, target_std_specdim], dim=1)
-                global_cond = None
-            elif params.condition_prior_global:
-                target_std_specdim = target_std[:, :: params.hop_samples].unsqueeze(1)
-                global_cond = target_std_specdim
-            else:
-                global_cond = None
-
-        start = time()
-        with torch.no_grad():
-            audio = (
-                torch.randn(
-                    spectrogram.shape[0],
-                    model.params.audio_channels,
-                    model.params.hop_samples
-                    * spectrogram.shape[-1]
-                    // model.params.audio_channels,
-                    device=device,
+                target_std = torch.cat(
+                    (target_std_lb[:, None, :], target_std_hb[:, None, :]), dim=1
                 )
-                * target_std
-            )
-            for n in range(len(alpha) - 1, -1, -1):
-                c1 = 1 / alpha[n] ** 0.5
-                c2 = beta[n] / (1 - alpha_cum[n]) ** 0.5
-                audio = c1 * ( audio - c2 * model(
-                                                audio,
-                                                spectrogram,
-                                                torch.tensor([T[n]], device=audio.device),
-                                                global_cond,
-                                            ).squeeze(1)
+
+                # * number of mel frames of every utterance before padding
+                lengths = features.get(
+                    "lengths", [spectrogram.shape[-1]] * spectrogram.shape[0]
                 )
+                if state.graphs is not None or args.compile:
+                    # * share captured graphs and compiled code between utterances of similar length,
+                    # * the padding is trimmed before saving
+                    spectrogram, target_std = pad_to_bucket(
+                        spectrogram, target_std, args.bucket_frames, params.std_min
+                    )
+
+                if params.condition_prior:
+                    target_std_specdim = target_std[:, :: params.hop_samples].unsqueeze(1)
+                    spectrogram = torch.cat([spectrogram, target_std_specdim], dim=1)
+                    global_cond = None
+                elif params.condition_prior_global:
+                    target_std_specdim = target_std[:, :: params.hop_samples].unsqueeze(1)
+                    global_cond = target_std_specdim
+                else:
+                    global_cond = None
+
+                if state.graphs is not None:
+                    # * capture outside of the timed region, once per bucket
+                    get_sampling_graph(
+                        state.graphs,
+                        model,
+                        spectrogram,
+                        target_std,
+                        global_cond,
+                        state.autocast_dtype,
+                        state.postprocess_fn,
+                        state.graph_pool,
+                    )
+                if args.compile and tuple(spectrogram.shape) not in state.compiled_shapes:
+                    warmup(
+                        model, spectrogram, target_std, global_cond, state.autocast_dtype
+                    )
+                    state.postprocess_fn(torch.zeros_like(target_std))
+                    state.compiled_shapes.add(tuple(spectrogram.shape))
+
+            # * grow the pinned output buffer outside of the timed region
+            pin_memory = device.type == "cuda"
+            reuse_buffer(
+                state.host_buffers,
+                "audio",
+                (target_std.numel(),),
+                device="cpu",
+                pin_memory=pin_memory,
+            )
 
-                if n > 0:
-                    noise = torch.randn_like(audio) * target_std
-                    sigma = (
-                        (1.0 - alpha_cum[n - 1]) / (1.0 - alpha_cum[n]) * beta[n]
-                    ) ** 0.5
-                    audio += sigma * noise
-                audio = torch.clamp(audio, -1.0, 1.0)
-        # * OPTIONAL: here, we remove the cutoff alias, a phenomenon cause by redundant information
-        # * around cutoff frequency band
-        if hasattr(params, "enable_remove_cutoff_alias") and params.enable_remove_cutoff_alias:
-            l, h = remove_cutoff_alias(audio[:, 0:1, :], audio[:, 1:2, :])
-        else:
-            l, h = audio[:, 0:1, :], audio[:, 1:2, :]
-        # * Convert output in wavelet domain back to origin waveform's domain
-        # * Equation 7 in our paper
-        audio_pred = idwt((l, [h])).squeeze(1)
-        # 
-        gen_dur.append(time() - start)
-        n_samples.append(audio_pred.shape[-1])
-        sample_name = "{:04d}.wav".format(i + 1)
-        sample_name = features["filename"][0].split("/")[-1]
-        torchaudio.save(
-            os.path.join(sample_path, sample_name),
-            audio_pred.cpu(),
-            sample_rate=model.params.sample_rate,
-        )
+            start = time()
+            audio_pred = predict(
+                model,
+                spectrogram,
+                target_std,
+                global_cond,
+                T=state.T,
+                alpha=state.alpha,
+                alpha_cum=state.alpha_cum,
+                beta=state.beta,
+                coeffs=state.coeffs,
+                graphs=state.graphs,
+                buffers=state.buffers,
+                autocast_dtype=state.autocast_dtype,
+                postprocess_fn=state.postprocess_fn,
+                generator=state.generator,
+                graph_pool=state.graph_pool,
+            )
+            # * copy into the reused pinned buffer and only wait for this copy
+            host = reuse_buffer(
+                state.host_buffers,
+                "audio",
+                audio_pred.shape,
+                device="cpu",
+                pin_memory=pin_memory,
+            )
+            host.copy_(audio_pred, non_blocking=True)
+            if device.type == "cuda":
+                torch.cuda.current_stream().synchronize()
+            gen_dur.append(time() - start)
+            n_samples.append(sum(lengths) * params.hop_samples)
+            # * encoding and disk I/O overlap with the next batch
+            for b, filename in enumerate(features["filename"]):
+                sample_name = filename.split("/")[-1]
+                writes.append(
+                    state.writer.submit(
+                        torchaudio.save,
+                        os.path.join(state.sample_path, sample_name),
+                        host[b : b + 1, : lengths[b] * params.hop_samples].clone(),
+                        sample_rate=model.params.sample_rate,
+                    )
+                )
+    except BaseException:
+        # * do not leave the writes of a failed filelist running behind the next one
+        for write in writes:
+            write.cancel()
+        raise
+    finally:
+        wait(writes)
+    for write in writes:
+        write.result()
     print("RTF: ", sum(gen_dur) / sum(n_samples) * 22050)
 
+
+def main(args):
+    state = setup(args)
+    if args.filelist is not None:
+        run(state, args.filelist)
+    if args.server:
+        # * keep the model, compiled code and captured graphs alive
+        # * and serve one filelist path per line of stdin until EOF
+        for line in sys.stdin:
+            filelist = line.strip()
+            if not filelist:
+                continue
+            try:
+                run(state, filelist)
+            except Exception:
+                # * one broken filelist must not stop the server
+                print("WARNING: failed to process {}".format(filelist))
+                traceback.print_exc()
+    state.writer.shutdown(wait=True)
+
 if __name__ == "__main__":
     parser = ArgumentParser(description="runs inference from the test set filelist")
     parser.add_argument(
@@ -370,6 +933,8 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "filelist",
+        nargs="?",
+        default=None,
         help="text file containing data path."
         "example: for LJSpeech, refer to ./filelists/test.txt",
     )
@@ -395,4 +960,63 @@ if __name__ == "__main__":
         help="number of fast inference diffusion steps for sampling."
         "6, 12, and 50 steps are officially supported. If other value is provided, linear beta schedule is used.",
     )
-    main(parser.parse_args())
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="seed of the sampling noise. If not provided, a random seed is used",
+    )
+    parser.add_argument(
+        "--batch_size",
+        "-b",
+        type=int,
+        default=1,
+        help="number of utterances sampled together. "
+        "Utterances are grouped by length and padded to the longest one in the batch",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="number of data loading workers that prepare the next utterances while sampling",
+    )
+    parser.add_argument(
+        "--bucket_frames",
+        type=int,
+        default=64,
+        help="with --cuda_graph or --compile, utterances are padded up to a multiple of this many mel frames "
+        "so that one captured graph or compiled shape serves every utterance of the bucket",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["fp32", "bf16", "fp16"],
+        default="fp32",
+        help="precision of the model forward. bf16 and fp16 run the model under autocast, "
+        "the denoising update stays in fp32",
+    )
+    overhead = parser.add_mutually_exclusive_group()
+    overhead.add_argument(
+        "--compile",
+        action="store_true",
+        default=False,
+        help="compile the model with torch.compile(mode='reduce-overhead'). "
+        "Compilation runs before timing, once per --bucket_frames bucket",
+    )
+    overhead.add_argument(
+        "--cuda_graph",
+        action="store_true",
+        default=False,
+        help="capture the reverse diffusion step into a CUDA graph and replay it at every step. "
+        "One graph is captured per --bucket_frames bucket. Ignored when running on CPU",
+    )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        default=False,
+        help="after the optional filelist, keep running and read more filelist paths from stdin, one per line. "
+        "The model is loaded, compiled and captured only once",
+    )
+    args = parser.parse_args()
+    if args.filelist is None and not args.server:
+        parser.error("filelist is required unless --server is given")
+    main(args)
@@ -39,6 +39,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import math
 import torch
 
 from librosa.filters import mel as librosa_mel_fn
@@ -46,11 +47,14 @@ from librosa.util import normalize
 from scipy.io.wavfile import read
 
 MAX_WAV_VALUE = 32768.0
+CLIP_VAL = 1e-5
+# log(clip_val) of dynamic_range_compression_torch, i.e. the log-mel of silence
+SILENCE_LOG_MEL = math.log(CLIP_VAL)
 mel_basis = {}
 hann_window = {}
 
 
-def dynamic_range_compression_torch(x, C=1, clip_val=1e-5):
+def dynamic_range_compression_torch(x, C=1, clip_val=CLIP_VAL):
     return torch.log(torch.clamp(x, min=clip_val) * C)
 
 
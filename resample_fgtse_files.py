@@ -1,28 +1,51 @@
 import os
-import librosa
+from math import gcd
+from multiprocessing import Pool
+
 import soundfile as sf
+from scipy.signal import resample_poly
+
+# soxr is listed in requirements.txt, scipy is only the fallback for environments without it
+try:
+    import soxr
+except ImportError:
+    soxr = None
 
 # Folder with your original 16kHz .wav files
 input_folder = 'fgtse_samples'
 # Folder to save the new 22kHz files
 output_folder = 'resampled_fgtse_samples'
 
-os.makedirs(output_folder, exist_ok=True)
 
-for filename in os.listdir(input_folder):
-    if filename.endswith('.wav'):
-        input_path = os.path.join(input_folder, filename)
-        output_path = os.path.join(output_folder, filename)
+def resample_file(filename):
+    input_path = os.path.join(input_folder, filename)
+    output_path = os.path.join(output_folder, filename)
+
+    # Load audio at its original sample rate, downmixed to mono like librosa.load
+    audio, sr = sf.read(input_path, dtype='float32')
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
+
+    # Only resample if not already 22050
+    if sr != 22050 and soxr is not None:
+        audio_22k = soxr.resample(audio, sr, 22050, quality='HQ')
+    elif sr != 22050:
+        # Polyphase resampling in scipy, with the Kaiser window of librosa's kaiser_best
+        g = gcd(sr, 22050)
+        audio_22k = resample_poly(audio, 22050 // g, sr // g, window=('kaiser', 14.769656459379492))
+    else:
+        audio_22k = audio
+
+    # Save to output folder
+    sf.write(output_path, audio_22k, 22050)
+    print(f"Resampled {filename} to 22050 Hz")
+
 
-        # Load audio at its original sample rate
-        audio, sr = librosa.load(input_path, sr=None)
+if __name__ == '__main__':
+    os.makedirs(output_folder, exist_ok=True)
 
-        # Only resample if not already 22050
-        if sr != 22050:
-            audio_22k = librosa.resample(audio, orig_sr=sr, target_sr=22050)
-        else:
-            audio_22k = audio
+    wav_files = [f for f in os.listdir(input_folder) if f.endswith('.wav')]
 
-        # Save to output folder
-        sf.write(output_path, audio_22k, 22050)
-        print(f"Resampled {filename} to 22050 Hz")
\ No newline at end of file
+    # Files are independent, so resample them in parallel
+    with Pool(os.cpu_count()) as pool:
+        pool.map(resample_file, wav_files)
@@ -1,18 +1,24 @@
 import os
 import random
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Path to your folder
 folder_path = 'LJSpeech-1.1/wavs'
 
-# Get a list of all files (not folders) in the directory
-all_files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
+# Get a list of all .wav files (not folders) in the directory
+# DirEntry carries the file type from the directory read, so no extra stat per file
+with os.scandir(folder_path) as entries:
+    all_files = [e.name for e in entries if e.is_file(follow_symlinks=False) and e.name.endswith('.wav')]
 
 # Randomly select 500 files
 sample_files = random.sample(all_files, 500)
 
 os.makedirs('sampled_files', exist_ok=True)
 
-# Print or save the selected files
-for file in sample_files:
+# Copy the selected files, copies are I/O bound so run them concurrently
+def copy_file(file):
     shutil.copy2(os.path.join(folder_path, file), os.path.join('sampled_files', file))
+
+with ThreadPoolExecutor(max_workers=8) as executor:
+    list(executor.map(copy_file, sample_files))